@@ -1,11 +1,43 @@
 # supervisor/intent_identifier.py
+import asyncio
+import cachetools
 import logging
 import json
+import orjson
 import os
-from typing import Dict, List, Optional, Tuple
+import re
+import tempfile
+from collections import Counter, OrderedDict
+from typing import Dict, Final, List, Optional, Tuple
 import google.generativeai as genai
 from pathlib import Path # Ensure this is imported at the top
 
+# Optional: semantic cache needs sentence-transformers + faiss; degrade
+# gracefully to plain Gemini calls when they are not installed.
+try:
+    import faiss
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    SEMANTIC_CACHE_AVAILABLE = True
+except ImportError:
+    SEMANTIC_CACHE_AVAILABLE = False
+
+# Optional: compiled multi-pattern matcher for the keyword fallback; degrade
+# to the pure-Python keyword scan when pyahocorasick is not installed.
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# Optional: the Gemini Batch API lives in the newer google-genai SDK; offline
+# batch classification is unavailable without it.
+try:
+    from google import genai as genai_batch_sdk
+    BATCH_API_AVAILABLE = True
+except ImportError:
+    BATCH_API_AVAILABLE = False
+
 _logger = logging.getLogger(__name__)
 
 
@@ -17,8 +49,23 @@ else:
     genai.configure(api_key=GEMINI_API_KEY)
 
 # Configuration
-CONFIDENCE_THRESHOLD = 0.70  # Minimum confidence to proceed without clarification
-MIN_ACCEPTABLE_CONFIDENCE = 0.50  # Below this, always ask for clarification
+CONFIDENCE_THRESHOLD: Final = 0.70  # Minimum confidence to proceed without clarification
+MIN_ACCEPTABLE_CONFIDENCE: Final = 0.50  # Below this, always ask for clarification
+BATCH_MAX_SIZE: Final = 40  # Max queries coalesced into one Gemini call
+BATCH_MAX_WAIT_MS: Final = 50  # How long the dispatcher waits to fill a batch
+GEMINI_CONCURRENCY_LIMIT: Final = int(os.getenv("GEMINI_CONCURRENCY_LIMIT", "8"))  # Max in-flight Gemini calls
+EMBEDDING_MODEL_NAME: Final = "all-MiniLM-L6-v2"
+EMBEDDING_DIM: Final = 384  # Output dimension of all-MiniLM-L6-v2
+SEMANTIC_CACHE_THRESHOLD: Final = 0.92  # Min cosine similarity to reuse a cached intent
+SEMANTIC_CACHE_MAX_ENTRIES: Final = 10000
+LOCAL_CLASSIFIER_MIN_SCORE: Final = 0.75  # Min similarity to classify without Gemini
+LOCAL_CLASSIFIER_MIN_MARGIN: Final = 0.1  # Min lead over the runner-up agent
+HISTORY_SNIPPET_CHARS: Final = 120  # Max chars of each history message sent to Gemini
+KEYWORD_SHORTCIRCUIT_CONFIDENCE: Final = 0.6  # Min keyword confidence to skip Gemini
+INTENT_PREWARM: Final = os.getenv("INTENT_PREWARM", "0") == "1"  # Ping Gemini at startup
+EXACT_CACHE_MAX_ENTRIES: Final = 5000
+EXACT_CACHE_TTL_SECONDS: Final = 3600
+INTENT_BATCH_MODE: Final = os.getenv("INTENT_BATCH_MODE", "0") == "1"  # Enable offline Batch API
 BASE_DIR = Path(__file__).parent.parent
 REGISTRY_FILE = BASE_DIR / "config" / "registry.json"
 
@@ -42,63 +89,202 @@ def load_agent_descriptions_from_registry() -> Dict:
                 "keywords": agent.get('keywords', [])
             }
         
-        _logger.info(f"Loaded {len(agent_descriptions)} agent descriptions from registry")
+        _logger.info("Loaded %d agent descriptions from registry", len(agent_descriptions))
         return agent_descriptions
     
     except FileNotFoundError:
-        _logger.error(f"Registry file not found at {REGISTRY_FILE}")
+        _logger.error("Registry file not found at %s", REGISTRY_FILE)
         return {}
     except Exception as e:
-        _logger.error(f"Error loading registry: {e}")
+        _logger.error("Error loading registry: %s", e)
         return {}
 
-class IntentIdentifier:
-    def __init__(self):
-        # Use the correct Gemini model
-        self.model = genai.GenerativeModel('gemini-2.5-flash')
-        self.agent_descriptions = load_agent_descriptions_from_registry()
-        
-    def _build_agent_context(self) -> str:
-        """Build a formatted string of all available agents and their capabilities."""
-        if not self.agent_descriptions:
-            _logger.warning("No agent descriptions loaded, reloading from registry")
-            self.agent_descriptions = load_agent_descriptions_from_registry()
-        
-        context = "Available Learning System Agents:\n\n"
-        for agent_id, info in self.agent_descriptions.items():
-            context += f"Agent ID: {agent_id}\n"
-            context += f"Name: {info['name']}\n"
-            context += f"Description: {info['description']}\n"
-            context += f"Capabilities: {', '.join(info.get('capabilities', []))}\n"
-            if info.get('keywords'):
-                context += f"Keywords: {', '.join(info['keywords'])}\n"
-            context += "\n"
-        return context
-    
-    def _build_prompt(self, user_query: str, conversation_history: List[Dict] = None) -> str:
-        """Build the prompt for Gemini to identify intent."""
-        agent_context = self._build_agent_context()
-        
-        history_context = ""
-        if conversation_history and len(conversation_history) > 0:
-            history_context = "\n### Conversation History (Recent messages):\n"
-            # Only use last 5 messages for context
-            for msg in conversation_history[-5:]:
-                role = msg.get('role', 'user')
-                content = msg.get('content', '')
-                history_context += f"{role}: {content}\n"
-            history_context += "\nUse this conversation history to better understand the current user query.\n"
-        
-        prompt = f"""You are an expert intent classifier for an educational multi-agent system. Your task is to analyze student queries and determine which specialized learning agent should handle the request.
+# Agent descriptions are loaded once at import time. The rendered agent
+# context and the static parts of the intent prompt never change per request,
+# so they are precomputed here instead of being rebuilt on every query.
+AGENT_DESCRIPTIONS = load_agent_descriptions_from_registry()
+
+# One-line purpose tags distilled offline from each agent's description and
+# examples. Sending these instead of the full descriptions roughly halves the
+# input tokens of every classification call.
+_COMPRESSED_AGENT_LINES = {
+    "gemini-wrapper": "general knowledge questions, explanations, open-ended chat",
+    "adaptive_quiz_master_agent": "create/generate quizzes, tests, MCQ and practice questions",
+    "assignment_coach_agent": "assignment/homework understanding, task breakdown, guidance",
+    "plagiarism_prevention_agent": "check text for plagiarism, rephrase to improve originality",
+    "research_scout_agent": "find research papers, academic articles, case studies",
+    "concept_reinforcement_agent": "extra practice and reinforcement for topics students struggle with",
+    "citation_manager_agent": "create/format citations and bibliographies (APA, MLA, Chicago, Harvard)",
+    "peer_collaboration_agent": "analyze team discussions, participation and collaboration patterns",
+    "adaptive_flashcard_agent": "create flashcards for memorization and spaced repetition",
+    "presentation_feedback_agent": "feedback on presentations, speeches, talk transcripts",
+    "lecture_insight_agent": "analyze lecture recordings/audio, generate notes and insights",
+    "question_anticipator_agent": "predict likely exam questions from syllabus and past papers",
+    "daily_revision_proctor_agent": "track daily study habits, reminders, revision progress",
+    "study_scheduler_agent": "create study timetables, schedules, time management plans",
+    "exam_readiness_agent": "assess exam readiness, create mock exams",
+}
+
+def _build_agent_context_static() -> str:
+    """Render a compact agent_id-to-purpose line per agent, once at import."""
+    if not AGENT_DESCRIPTIONS:
+        _logger.warning("No agent descriptions loaded, agent context will be empty")
 
-{agent_context}
+    parts = ["Available Learning System Agents (agent_id: purpose):\n"]
+    for agent_id, info in AGENT_DESCRIPTIONS.items():
+        tag = _COMPRESSED_AGENT_LINES.get(agent_id)
+        if tag is None:
+            # Agent added to the registry without a distilled tag yet:
+            # fall back to the first sentence of its description
+            tag = (info.get('description') or '').split('.')[0][:120]
+        parts.append(f"{agent_id}: {tag}\n")
+    return "".join(parts)
 
-{history_context}
+_AGENT_CONTEXT_STR = _build_agent_context_static()
+
+def _build_keyword_automaton():
+    """
+    Compile every agent keyword into one Aho-Corasick automaton so the
+    fallback classifier finds all keyword matches in a single C-level pass
+    over the query instead of one substring scan per keyword per agent.
+    """
+    if not AHOCORASICK_AVAILABLE or not AGENT_DESCRIPTIONS:
+        return None
 
-### Current User Query: 
-"{user_query}"
+    # A keyword may belong to several agents; keep them all per pattern
+    keyword_agents = {}
+    for agent_id, info in AGENT_DESCRIPTIONS.items():
+        for keyword in info.get('keywords', []):
+            keyword_agents.setdefault(keyword.lower(), []).append(agent_id)
 
-### Your Task:
+    automaton = ahocorasick.Automaton()
+    for keyword, agent_ids in keyword_agents.items():
+        automaton.add_word(keyword, (keyword, tuple(agent_ids)))
+    automaton.make_automaton()
+    return automaton
+
+_KEYWORD_AUTOMATON = _build_keyword_automaton()
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+# Schema enforced through Gemini's structured-output support so responses
+# come back as raw, schema-valid JSON (no markdown fences, no retries on
+# malformed output).
+_INTENT_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "agent_id": {"type": "string"},
+        "confidence": {"type": "number"},
+        "reasoning": {"type": "string"},
+        "is_ambiguous": {"type": "boolean"},
+        "clarifying_questions": {"type": "array", "items": {"type": "string"}},
+        "extracted_params": {
+            "type": "object",
+            "properties": {
+                "topic": {"type": "string", "nullable": True},
+                "subject": {"type": "string", "nullable": True},
+                "difficulty": {"type": "string", "nullable": True},
+                "num_questions": {"type": "string", "nullable": True},
+                "style": {"type": "string", "nullable": True},
+            },
+        },
+        "alternative_agents": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["agent_id", "confidence", "reasoning", "is_ambiguous"],
+}
+
+_INTENT_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": _INTENT_RESPONSE_SCHEMA,
+}
+
+_BATCH_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": dict(_INTENT_RESPONSE_SCHEMA["properties"],
+                               query_index={"type": "integer"}),
+            "required": _INTENT_RESPONSE_SCHEMA["required"],
+        },
+    },
+}
+
+# Matches a response wrapped in ```/```json fences, capturing the body
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*\n?(.*?)\n?```\s*$', re.DOTALL)
+
+def _strip_markdown_fences(response_text: str) -> str:
+    """Remove surrounding markdown code fences from a model response."""
+    m = _FENCE_RE.match(response_text)
+    return m.group(1) if m else response_text.strip()
+
+# Classroom workloads repeat identical queries ("quiz me on python") from many
+# students; hits here bypass every other tier, including the embedding lookup.
+_EXACT_CACHE = cachetools.TTLCache(maxsize=EXACT_CACHE_MAX_ENTRIES,
+                                   ttl=EXACT_CACHE_TTL_SECONDS)
+
+def _exact_cache_key(user_query: str, conversation_history: List[Dict] = None) -> Tuple:
+    """Key on the normalized query plus a hash of the last history turn."""
+    last_turn = tuple(
+        (msg.get('content', '') or '')[:80]
+        for msg in (conversation_history or [])[-1:]
+    )
+    return (user_query.strip().lower(), hash(last_turn))
+
+# Structure-of-arrays layout for the fallback scan: parallel immutable
+# tuples indexed by agent position, so the tight scoring loop iterates
+# contiguous tuples instead of chasing nested dict lookups.
+_AGENT_IDS = tuple(AGENT_DESCRIPTIONS)
+
+def _build_keyword_tables() -> Tuple[Tuple, Tuple]:
+    """
+    Split each agent's keywords into a frozenset of single tokens and a tuple
+    of multi-word phrases, both aligned positionally with _AGENT_IDS. The
+    pure-Python fallback then scores the bulk of the keywords with one
+    C-level set intersection over the tokenized query and only
+    substring-scans the few multi-word phrases.
+    """
+    singles, multis = [], []
+    for agent_id in _AGENT_IDS:
+        keywords = [k.lower() for k in AGENT_DESCRIPTIONS[agent_id].get('keywords', [])]
+        singles.append(frozenset(k for k in keywords if ' ' not in k))
+        multis.append(tuple(k for k in keywords if ' ' in k))
+    return tuple(singles), tuple(multis)
+
+_AGENT_KW_SINGLE, _AGENT_KW_MULTI = _build_keyword_tables()
+
+def _build_unique_keyword_map() -> Dict:
+    """
+    Map each single-token keyword that belongs to exactly one specialist
+    agent to that agent. A hit on one of these identifies the agent in O(1),
+    skipping the full scoring scan (e.g. "plagiarism" only ever means the
+    plagiarism agent). The catch-all gemini-wrapper is excluded: its keywords
+    are generic conversation words ("why", "explain", "describe") that appear
+    in queries meant for every other agent.
+    """
+    counts = Counter()
+    for info in AGENT_DESCRIPTIONS.values():
+        for keyword in {k.lower() for k in info.get('keywords', [])}:
+            counts[keyword] += 1
+    return {
+        keyword: agent_id
+        for agent_id, info in AGENT_DESCRIPTIONS.items()
+        if agent_id != "gemini-wrapper"
+        for keyword in {k.lower() for k in info.get('keywords', [])}
+        if counts[keyword] == 1 and ' ' not in keyword
+    }
+
+_UNIQUE_KW = _build_unique_keyword_map()
+
+# Static head/tail of the intent prompt, with the agent context baked in.
+# _build_prompt only has to join these with the per-request pieces.
+_PROMPT_HEAD = f"""You are an expert intent classifier for an educational multi-agent system. Your task is to analyze student queries and determine which specialized learning agent should handle the request.
+
+{_AGENT_CONTEXT_STR}
+"""
+
+_PROMPT_TAIL = """### Your Task:
 Analyze the query carefully and determine:
 1. Which agent is MOST appropriate to handle this request
 2. How confident you are in this decision (0.0 to 1.0)
@@ -106,24 +292,24 @@ Analyze the query carefully and determine:
 4. What parameters can be extracted from the query
 
 ### Response Format:
-Respond with ONLY a JSON object in this EXACT format (no markdown, no backticks):
+Respond with a JSON object in this EXACT format:
 
-{{
+{
     "agent_id": "exact_agent_id_from_list_above",
     "confidence": 0.95,
     "reasoning": "Clear explanation of why this agent was chosen",
     "is_ambiguous": false,
     "clarifying_questions": [],
-    "extracted_params": {{
+    "extracted_params": {
         "topic": "extracted topic if mentioned",
         "subject": "extracted subject if mentioned",
         "difficulty": "beginner/intermediate/advanced if mentioned",
         "num_questions": "number if mentioned",
         "style": "citation style if mentioned",
         "any_other_relevant_param": "value"
-    }},
+    },
     "alternative_agents": []
-}}
+}
 
 ### Decision Rules:
 
@@ -161,7 +347,7 @@ Respond with ONLY a JSON object in this EXACT format (no markdown, no backticks)
 ### Examples:
 
 Query: "Create a quiz on Python with 10 questions"
-→ agent_id: "adaptive_quiz_master_agent", confidence: 0.95, extracted_params: {{"topic": "Python", "num_questions": 10}}
+→ agent_id: "adaptive_quiz_master_agent", confidence: 0.95, extracted_params: {"topic": "Python", "num_questions": 10}
 
 Query: "Help me with my assignment"
 → is_ambiguous: true, clarifying_questions: ["What subject is your assignment on?", "What specific help do you need (understanding, breakdown, resources)?"]
@@ -170,15 +356,462 @@ Query: "Check if my essay is plagiarized"
 → agent_id: "plagiarism_prevention_agent", confidence: 0.90
 
 Query: "Find papers on machine learning"
-→ agent_id: "research_scout_agent", confidence: 0.92, extracted_params: {{"topic": "machine learning"}}
+→ agent_id: "research_scout_agent", confidence: 0.92, extracted_params: {"topic": "machine learning"}
 
 Query: "What is photosynthesis?"
 → agent_id: "gemini-wrapper", confidence: 0.85 (general knowledge question, no specialized agent needed)
 
 Now analyze the current user query and respond with the JSON object."""
 
-        return prompt
-    
+# Tail used when several queued queries are classified in one Gemini call.
+_BATCH_PROMPT_TAIL = """### Your Task:
+For EACH numbered user query above, determine:
+1. Which agent is MOST appropriate to handle it
+2. How confident you are in this decision (0.0 to 1.0)
+3. Whether the query is clear enough or needs clarification
+4. What parameters can be extracted from the query
+
+### Response Format:
+Respond with a JSON array with one object per query, in the same order as the
+queries. Each object must have this EXACT format:
+
+[
+    {
+        "query_index": 1,
+        "agent_id": "exact_agent_id_from_list_above",
+        "confidence": 0.95,
+        "reasoning": "Clear explanation of why this agent was chosen",
+        "is_ambiguous": false,
+        "clarifying_questions": [],
+        "extracted_params": {},
+        "alternative_agents": []
+    }
+]
+
+If a query is vague, set "is_ambiguous": true and provide 2-3 clarifying questions.
+If no specific agent matches well, use "gemini-wrapper".
+
+Now analyze every query and respond with the JSON array."""
+
+
+class BatchingIntentDispatcher:
+    """
+    Coalesces concurrent intent queries into batched Gemini calls.
+
+    Queries arriving within a small time window are drained from an
+    asyncio.Queue and classified together in a single Gemini call, so the
+    agent-context prompt prefix is amortized across the whole batch and
+    throughput scales with batch size instead of serializing on the LLM
+    round-trip. A batch of one falls back to the regular single-query path
+    (which also keeps per-query conversation history; batched queries are
+    classified without history).
+    """
+
+    def __init__(self, identifier: "IntentIdentifier",
+                 max_batch: int = BATCH_MAX_SIZE,
+                 max_wait_ms: int = BATCH_MAX_WAIT_MS):
+        self._identifier = identifier
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, user_query: str, conversation_history: List[Dict] = None) -> Dict:
+        """Queue a query for classification and wait for its result."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((user_query, conversation_history, future))
+        return await future
+
+    def _ensure_worker(self):
+        # Created lazily so the dispatcher binds to the running event loop.
+        # An asyncio.Queue binds to the loop that first blocks on it, so when
+        # a different loop shows up (tests, asyncio.run per call) the queue
+        # and worker must both be rebuilt, not just the worker.
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = None
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+            self._worker.add_done_callback(self._on_worker_done)
+
+    def _on_worker_done(self, task: asyncio.Task):
+        # The worker should only stop by cancellation; if it died with an
+        # exception, resolve whatever is still queued so no submit() hangs.
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is None:
+            return
+        _logger.error("Batch dispatcher worker died: %s", exc)
+        queue = self._queue
+        while queue is not None and not queue.empty():
+            try:
+                user_query, _, future = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if not future.done():
+                future.set_result(self._identifier._fallback_intent(user_query))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                _logger.error("Batch intent classification failed: %s", e)
+                for query, _, future in batch:
+                    if not future.done():
+                        future.set_result(self._identifier._fallback_intent(query))
+
+    async def _flush(self, batch):
+        if len(batch) == 1:
+            user_query, conversation_history, future = batch[0]
+            future.set_result(
+                await self._identifier._classify_single(user_query, conversation_history)
+            )
+            return
+
+        _logger.info("Classifying batch of %d queries in one Gemini call", len(batch))
+        queries = [item[0] for item in batch]
+        prompt = "".join([
+            _PROMPT_HEAD,
+            "### User Queries:\n",
+            "".join(f'{i}. "{q}"\n' for i, q in enumerate(queries, 1)),
+            "\n",
+            _BATCH_PROMPT_TAIL,
+        ])
+
+        response = await self._identifier._generate(prompt, _BATCH_GENERATION_CONFIG)
+        response_text = _strip_markdown_fences(response.text)
+
+        results = orjson.loads(response_text)
+        if not isinstance(results, list) or len(results) != len(batch):
+            raise ValueError(
+                f"Expected {len(batch)} classifications, got {results!r:.200}"
+            )
+
+        for (user_query, _, future), intent_result in zip(batch, results):
+            intent_result.pop("query_index", None)
+            try:
+                future.set_result(self._identifier._postprocess_result(intent_result))
+            except Exception as e:
+                _logger.error("Error post-processing batched result: %s", e)
+                future.set_result(self._identifier._fallback_intent(user_query))
+
+
+class SemanticIntentCache:
+    """
+    Two-tier cache for intent classifications.
+
+    Tier 1 is an exact-match LRU keyed on the normalized query. Tier 2 embeds
+    the query with a local sentence-transformer and does nearest-neighbor
+    lookup over previously classified queries in a FAISS inner-product index,
+    so near-duplicates ("quiz me on python" vs "make a quiz on python") reuse
+    the prior result without any Gemini round-trip.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 embedder=None):
+        self._threshold = threshold
+        self._max_entries = max_entries
+        self._exact: OrderedDict = OrderedDict()
+        self._embedder = embedder or SentenceTransformer(EMBEDDING_MODEL_NAME)
+        self._index = faiss.IndexFlatIP(EMBEDDING_DIM)
+        # row i of the index -> (query, result, embedding)
+        self._entries: List[Tuple[str, Dict, "np.ndarray"]] = []
+
+    def embed(self, query: str):
+        # Normalized embeddings make inner product equal cosine similarity
+        vec = self._embedder.encode([query], normalize_embeddings=True)
+        return np.asarray(vec, dtype=np.float32)
+
+    def get(self, user_query: str, query_vec=None) -> Optional[Dict]:
+        key = user_query.strip().lower()
+        if key in self._exact:
+            self._exact.move_to_end(key)
+            _logger.info("Semantic cache exact hit for query: %s", user_query)
+            return dict(self._exact[key])
+
+        if self._index.ntotal == 0:
+            return None
+
+        if query_vec is None:
+            query_vec = self.embed(user_query)
+        scores, indices = self._index.search(query_vec, 1)
+        score, idx = float(scores[0][0]), int(indices[0][0])
+        if idx >= 0 and score >= self._threshold:
+            cached_query, result, _ = self._entries[idx]
+            _logger.info(
+                "Semantic cache hit (%.3f) for query: %s (matched: %s)",
+                score, user_query, cached_query
+            )
+            return dict(result)
+        return None
+
+    def put(self, user_query: str, intent_result: Dict, query_vec=None):
+        key = user_query.strip().lower()
+        self._exact[key] = dict(intent_result)
+        self._exact.move_to_end(key)
+        while len(self._exact) > self._max_entries:
+            self._exact.popitem(last=False)
+
+        if query_vec is None:
+            query_vec = self.embed(user_query)
+
+        if len(self._entries) >= self._max_entries:
+            # FAISS flat indexes have no cheap removal; rebuild from the
+            # newest half of the entries when the bound is exceeded. The
+            # stored embeddings are reused so no entry is re-encoded.
+            self._entries = self._entries[len(self._entries) // 2:]
+            self._index.reset()
+            self._index.add(np.vstack([vec for _, _, vec in self._entries]))
+
+        self._index.add(query_vec)
+        self._entries.append((user_query, dict(intent_result), query_vec))
+
+
+class LocalIntentClassifier:
+    """
+    Classifies obvious queries locally via embedding nearest-neighbor.
+
+    Each agent's keyword phrases (the registry ships no example intents, so
+    the keywords serve as example phrases) are embedded once at startup into
+    a FAISS index. An incoming query is classified by cosine similarity to
+    those phrases: when the top match is strong and clearly ahead of the
+    runner-up agent, the ~1ms local lookup replaces the Gemini round-trip.
+    """
+
+    def __init__(self, embedder=None):
+        self._embedder = embedder or SentenceTransformer(EMBEDDING_MODEL_NAME)
+        examples = [
+            (agent_id, phrase)
+            for agent_id, info in AGENT_DESCRIPTIONS.items()
+            for phrase in info.get('keywords', [])
+        ]
+        self._agent_ids = [agent_id for agent_id, _ in examples]
+        self._index = faiss.IndexFlatIP(EMBEDDING_DIM)
+        if examples:
+            vectors = self._embedder.encode(
+                [phrase for _, phrase in examples],
+                normalize_embeddings=True,
+                batch_size=64,
+            )
+            self._index.add(np.asarray(vectors, dtype=np.float32))
+
+    def embed(self, query: str):
+        vec = self._embedder.encode([query], normalize_embeddings=True)
+        return np.asarray(vec, dtype=np.float32)
+
+    def classify(self, user_query: str, query_vec=None) -> Optional[Dict]:
+        """Return an intent result for clear-cut queries, else None."""
+        if self._index.ntotal == 0:
+            return None
+
+        if query_vec is None:
+            query_vec = self.embed(user_query)
+        k = min(3, self._index.ntotal)
+        scores, indices = self._index.search(query_vec, k)
+
+        top_score = float(scores[0][0])
+        top_agent = self._agent_ids[int(indices[0][0])]
+        if top_score < LOCAL_CLASSIFIER_MIN_SCORE:
+            return None
+
+        # Margin is measured against the best-scoring *different* agent
+        runner_up = 0.0
+        for score, idx in zip(scores[0][1:], indices[0][1:]):
+            if idx >= 0 and self._agent_ids[int(idx)] != top_agent:
+                runner_up = float(score)
+                break
+        if top_score - runner_up < LOCAL_CLASSIFIER_MIN_MARGIN:
+            return None
+
+        _logger.info(
+            "Local embedding classifier matched %s (%.3f) for query: %s",
+            top_agent, top_score, user_query
+        )
+        return {
+            "agent_id": top_agent,
+            "confidence": round(min(0.95, top_score), 2),
+            "reasoning": "Matched agent example phrases via local embedding similarity",
+            "is_ambiguous": False,
+            "clarifying_questions": [],
+            "extracted_params": {},
+            "alternative_agents": []
+        }
+
+
+class BatchHandle:
+    """Tracks one batch-classification job submitted to the Gemini Batch API."""
+
+    def __init__(self, job_name: str, num_queries: int):
+        self.job_name = job_name
+        self.num_queries = num_queries
+
+
+class IntentIdentifier:
+    # Singleton with a fixed attribute set: slots drop the per-instance
+    # __dict__ and make attribute access marginally cheaper
+    __slots__ = ('model', 'agent_descriptions', '_dispatcher',
+                 '_gemini_semaphore', '_semantic_cache', '_local_classifier')
+
+    def __init__(self):
+        # Use the correct Gemini model
+        self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self.agent_descriptions = AGENT_DESCRIPTIONS
+        self._dispatcher = BatchingIntentDispatcher(self)
+        # Cap concurrent in-flight Gemini calls to respect rate limits
+        self._gemini_semaphore = asyncio.Semaphore(GEMINI_CONCURRENCY_LIMIT)
+        if SEMANTIC_CACHE_AVAILABLE:
+            # One embedder shared between the cache and the local classifier
+            embedder = SentenceTransformer(EMBEDDING_MODEL_NAME)
+            self._semantic_cache = SemanticIntentCache(embedder=embedder)
+            self._local_classifier = LocalIntentClassifier(embedder=embedder)
+        else:
+            _logger.warning("sentence-transformers/faiss not installed, semantic cache and local classifier disabled")
+            self._semantic_cache = None
+            self._local_classifier = None
+
+    async def _generate(self, prompt: str, generation_config: Dict = None):
+        """
+        Call Gemini without blocking the event loop.
+
+        Uses the SDK's async API so concurrent requests interleave their
+        network round-trips on one event loop; falls back to a worker thread
+        if the installed SDK has no async variant.
+        """
+        if generation_config is None:
+            generation_config = _INTENT_GENERATION_CONFIG
+        async with self._gemini_semaphore:
+            generate_async = getattr(self.model, 'generate_content_async', None)
+            if generate_async is not None:
+                return await generate_async(prompt, generation_config=generation_config)
+            return await asyncio.to_thread(
+                self.model.generate_content, prompt, generation_config=generation_config
+            )
+
+    async def prewarm(self):
+        """
+        Issue a tiny Gemini call so the SDK's lazy first-call handshake
+        happens at startup instead of on the first user request.
+        """
+        try:
+            await self._generate("ping")
+            _logger.info("Gemini model pre-warmed")
+        except Exception as e:
+            _logger.warning("Gemini pre-warm failed: %s", e)
+
+    def _batch_client(self):
+        if not INTENT_BATCH_MODE:
+            raise RuntimeError("Batch classification disabled; set INTENT_BATCH_MODE=1")
+        if not BATCH_API_AVAILABLE:
+            raise RuntimeError("google-genai package required for the Gemini Batch API")
+        return genai_batch_sdk.Client(api_key=GEMINI_API_KEY)
+
+    def submit_batch(self, queries: List[str]) -> BatchHandle:
+        """
+        Submit a non-interactive batch of queries to the Gemini Batch API.
+
+        Offline pipelines (nightly analytics, backfills) should go through
+        here instead of identify_intent: the Batch API costs half the
+        interactive price in exchange for a 24h completion SLA. Results are
+        fetched later via get_batch_status/parse_batch_results.
+        """
+        client = self._batch_client()
+
+        input_file = tempfile.NamedTemporaryFile(
+            mode='w', suffix='.jsonl', prefix='intent_batch_', delete=False
+        )
+        with input_file as f:
+            for query in queries:
+                prompt = self._build_prompt(query)
+                f.write(json.dumps({
+                    "contents": [{"role": "user", "parts": [{"text": prompt}]}]
+                }) + "\n")
+
+        try:
+            uploaded = client.files.upload(
+                file=input_file.name,
+                config={"mime_type": "application/jsonl"},
+            )
+        finally:
+            # The upload owns the content now; don't leak a temp file per batch
+            os.unlink(input_file.name)
+        job = client.batches.create(
+            model='gemini-2.5-flash',
+            src=uploaded.name,
+            config={"display_name": "intent-classification-batch"},
+        )
+        _logger.info("Submitted batch job %s with %d queries", job.name, len(queries))
+        return BatchHandle(job.name, len(queries))
+
+    def get_batch_status(self, handle: BatchHandle) -> str:
+        """Return the current state of a submitted batch job."""
+        job = self._batch_client().batches.get(name=handle.job_name)
+        return job.state.name
+
+    def parse_batch_results(self, result_lines: List[str]) -> List[Dict]:
+        """
+        Parse downloaded batch-result JSONL lines with the same pipeline as
+        interactive responses (fence stripping, validation, thresholds).
+        Lines the Batch API failed (error records) or that don't parse
+        degrade to the keyword fallback instead of discarding the batch.
+        """
+        results = []
+        for line in result_lines:
+            if not line.strip():
+                continue
+            try:
+                record = orjson.loads(line)
+                if "error" in record:
+                    raise ValueError(record["error"])
+                text = record["response"]["candidates"][0]["content"]["parts"][0]["text"]
+                intent_result = orjson.loads(_strip_markdown_fences(text))
+                results.append(self._postprocess_result(intent_result))
+            except Exception as e:
+                _logger.error("Failed to parse batch result line: %s", e)
+                results.append(self._fallback_intent(""))
+        return results
+
+    def _build_prompt(self, user_query: str, conversation_history: List[Dict] = None) -> str:
+        """Build the prompt for Gemini to identify intent."""
+        history_context = ""
+        if conversation_history and len(conversation_history) > 0:
+            history_parts = ["\n### Conversation History (Recent messages):\n"]
+            # Only use last 5 messages for context
+            for msg in conversation_history[-5:]:
+                role = msg.get('role', 'user')
+                # Long prior messages bloat every call; a short snippet is
+                # enough context for routing
+                content = (msg.get('content', '') or '')[:HISTORY_SNIPPET_CHARS]
+                history_parts.append(f"{role}: {content}\n")
+            history_parts.append("\nUse this conversation history to better understand the current user query.\n")
+            history_context = "".join(history_parts)
+
+        return "".join([
+            _PROMPT_HEAD,
+            history_context,
+            '\n### Current User Query: \n"',
+            user_query,
+            '"\n\n',
+            _PROMPT_TAIL,
+        ])
+
     async def identify_intent(
         self, 
         user_query: str, 
@@ -193,78 +826,173 @@ Now analyze the current user query and respond with the JSON object."""
             
         Returns:
             Dict with agent_id, confidence, reasoning, and other metadata
+
+        Tiers are ordered cheapest-first; prompt construction and the Gemini
+        call only happen when every cheaper tier misses:
+        1. exact-match TTL cache
+        2. semantic (embedding) cache
+        3. keyword short-circuit
+        4. local embedding classifier
+        5. batched Gemini call
         """
+        cache_key = _exact_cache_key(user_query, conversation_history)
+        cached = _EXACT_CACHE.get(cache_key)
+        if cached is not None:
+            _logger.info("Exact cache hit for query: %s", user_query)
+            return dict(cached)
+
+        # Embed the query once, off the event loop, and reuse the vector for
+        # the semantic cache lookup, the local classifier and the cache store
+        query_vec = None
+        if self._semantic_cache is not None:
+            query_vec = await asyncio.to_thread(self._semantic_cache.embed, user_query)
+            cached = self._semantic_cache.get(user_query, query_vec)
+            if cached is not None:
+                return cached
+
+        # Queries whose keywords already identify one agent unambiguously
+        # don't need the embedding model or the LLM at all
+        keyword_result = self._keyword_intent(user_query)
+        if (keyword_result.get("confidence", 0) >= KEYWORD_SHORTCIRCUIT_CONFIDENCE
+                and not keyword_result.get("is_ambiguous", False)):
+            _logger.info("Keyword short-circuit for query: %s -> %s",
+                         user_query, keyword_result["agent_id"])
+            return keyword_result
+
+        if self._local_classifier is not None:
+            if query_vec is None:
+                query_vec = await asyncio.to_thread(self._local_classifier.embed, user_query)
+            local_result = self._local_classifier.classify(user_query, query_vec)
+            if local_result is not None:
+                return local_result
+
+        intent_result = await self._dispatcher.submit(user_query, conversation_history)
+
+        # Only cache confident, unambiguous classifications so low-quality
+        # fallback results cannot be replayed to similar queries.
+        if (not intent_result.get("is_ambiguous", False)
+                and intent_result.get("confidence", 0) >= CONFIDENCE_THRESHOLD):
+            _EXACT_CACHE[cache_key] = dict(intent_result)
+            if self._semantic_cache is not None:
+                self._semantic_cache.put(user_query, intent_result, query_vec)
+
+        return intent_result
+
+    async def _classify_single(
+        self,
+        user_query: str,
+        conversation_history: List[Dict] = None
+    ) -> Dict:
+        """Classify one query with its own prompt (used for batches of one)."""
         try:
             prompt = self._build_prompt(user_query, conversation_history)
             
-            _logger.info(f"Identifying intent for query: {user_query}")
+            _logger.info("Identifying intent for query: %s", user_query)
             
             # Call Gemini API
-            response = self.model.generate_content(prompt)
-            response_text = response.text.strip()
-            
+            response = await self._generate(prompt)
+
             # Clean up response (remove markdown code blocks if present)
-            if response_text.startswith("```json"):
-                response_text = response_text[7:]
-            if response_text.startswith("```"):
-                response_text = response_text[3:]
-            if response_text.endswith("```"):
-                response_text = response_text[:-3]
-            response_text = response_text.strip()
-            
+            response_text = _strip_markdown_fences(response.text)
+
+
             # Parse JSON response
-            intent_result = json.loads(response_text)
-            
-            # Validate agent_id exists
-            agent_id = intent_result.get("agent_id")
-            if agent_id not in self.agent_descriptions:
-                _logger.warning(f"LLM returned unknown agent_id: {agent_id}, defaulting to gemini-wrapper")
-                intent_result["agent_id"] = "gemini-wrapper"
-                intent_result["confidence"] = 0.5
-                intent_result["reasoning"] += " (Original agent not found in registry, using fallback)"
-            
-            # Apply confidence threshold logic
-            confidence = intent_result.get("confidence", 0.5)
-            
-            if confidence < MIN_ACCEPTABLE_CONFIDENCE:
-                # Force clarification for very low confidence
-                intent_result["is_ambiguous"] = True
-                if not intent_result.get("clarifying_questions"):
-                    intent_result["clarifying_questions"] = [
-                        "Could you provide more details about what you need help with?",
-                        "What subject or topic are you working on?",
-                        "What is your main goal right now?"
-                    ]
-                _logger.info(f"Confidence {confidence} below threshold {MIN_ACCEPTABLE_CONFIDENCE}, requesting clarification")
-            
-            _logger.info(f"Intent identified: {intent_result.get('agent_id')} (confidence: {confidence:.2f})")
-            
-            return intent_result
-            
-        except json.JSONDecodeError as e:
-            _logger.error(f"Failed to parse LLM response as JSON: {e}")
-            _logger.error(f"Raw response: {response_text}")
+            intent_result = orjson.loads(response_text)
+
+            return self._postprocess_result(intent_result)
+
+        except orjson.JSONDecodeError as e:
+            _logger.error("Failed to parse LLM response as JSON: %s", e)
+            _logger.error("Raw response: %s", response_text)
             return self._fallback_intent(user_query)
             
         except Exception as e:
-            _logger.error(f"Error in intent identification: {e}")
+            _logger.error("Error in intent identification: %s", e)
             return self._fallback_intent(user_query)
-    
+
+    def _postprocess_result(self, intent_result: Dict) -> Dict:
+        """Validate and normalize a parsed classification from the LLM."""
+        # Validate agent_id exists
+        agent_id = intent_result.get("agent_id")
+        if agent_id not in self.agent_descriptions:
+            _logger.warning("LLM returned unknown agent_id: %s, defaulting to gemini-wrapper", agent_id)
+            intent_result["agent_id"] = "gemini-wrapper"
+            intent_result["confidence"] = 0.5
+            intent_result["reasoning"] = intent_result.get("reasoning", "") + " (Original agent not found in registry, using fallback)"
+
+        # Apply confidence threshold logic
+        confidence = intent_result.get("confidence", 0.5)
+
+        if confidence < MIN_ACCEPTABLE_CONFIDENCE:
+            # Force clarification for very low confidence
+            intent_result["is_ambiguous"] = True
+            if not intent_result.get("clarifying_questions"):
+                intent_result["clarifying_questions"] = [
+                    "Could you provide more details about what you need help with?",
+                    "What subject or topic are you working on?",
+                    "What is your main goal right now?"
+                ]
+            _logger.info("Confidence %s below threshold %s, requesting clarification", confidence, MIN_ACCEPTABLE_CONFIDENCE)
+
+        _logger.info("Intent identified: %s (confidence: %.2f)", intent_result.get("agent_id"), confidence)
+
+        return intent_result
+
     def _fallback_intent(self, user_query: str) -> Dict:
         """Fallback when LLM fails - use keyword matching."""
         _logger.warning("Using fallback keyword-based intent identification")
-        
+        return self._keyword_intent(user_query)
+
+    def _keyword_intent(self, user_query: str) -> Dict:
+        """Score the query against agent keywords and build an intent result."""
         query_lower = user_query.lower()
+
+        # Keywords owned by exactly one agent identify it without scanning
+        # every agent's keyword list. Tokens are checked in query order so
+        # routing is deterministic; if unique keywords of several different
+        # agents appear, the full scoring scan decides instead.
+        unique_hits = {}
+        for token in _WORD_RE.findall(query_lower):
+            unique_agent = _UNIQUE_KW.get(token)
+            if unique_agent is not None and token not in unique_hits:
+                unique_hits[token] = unique_agent
+        if unique_hits and len(set(unique_hits.values())) == 1:
+            token, unique_agent = next(iter(unique_hits.items()))
+            return {
+                "agent_id": unique_agent,
+                "confidence": 0.8,
+                "reasoning": f"Keyword '{token}' is unique to this agent",
+                "is_ambiguous": False,
+                "clarifying_questions": [],
+                "extracted_params": {},
+                "alternative_agents": []
+            }
+
         best_match = None
         best_score = 0
-        
-        for agent_id, info in self.agent_descriptions.items():
-            keywords = info.get('keywords', [])
-            score = sum(1 for keyword in keywords if keyword.lower() in query_lower)
-            if score > best_score:
-                best_score = score
-                best_match = agent_id
-        
+
+        if _KEYWORD_AUTOMATON is not None:
+            # One pass over the query finds every keyword of every agent;
+            # count each distinct keyword once to match the old scoring.
+            scores = Counter()
+            matched = set()
+            for _, (keyword, agent_ids) in _KEYWORD_AUTOMATON.iter(query_lower):
+                if keyword in matched:
+                    continue
+                matched.add(keyword)
+                for agent_id in agent_ids:
+                    scores[agent_id] += 1
+            if scores:
+                best_match, best_score = scores.most_common(1)[0]
+        else:
+            tokens = set(_WORD_RE.findall(query_lower))
+            for i, kw_single in enumerate(_AGENT_KW_SINGLE):
+                score = len(tokens & kw_single)
+                score += sum(1 for phrase in _AGENT_KW_MULTI[i] if phrase in query_lower)
+                if score > best_score:
+                    best_score = score
+                    best_match = _AGENT_IDS[i]
+
         if best_match and best_score > 0:
             confidence = min(0.7, best_score * 0.2)
             return {
@@ -302,4 +1030,23 @@ def get_intent_identifier() -> IntentIdentifier:
     global _intent_identifier
     if _intent_identifier is None:
         _intent_identifier = IntentIdentifier()
-    return _intent_identifier
\ No newline at end of file
+        if INTENT_PREWARM:
+            _schedule_prewarm(_intent_identifier)
+    return _intent_identifier
+
+def _schedule_prewarm(identifier: IntentIdentifier):
+    """Run the pre-warm ping without blocking an already-running event loop."""
+    try:
+        asyncio.get_running_loop().create_task(identifier.prewarm())
+    except RuntimeError:
+        # No loop running (e.g. gunicorn post_fork hook): warm synchronously
+        asyncio.run(identifier.prewarm())
+
+def _reset_intent_identifier():
+    # The dispatcher queue and semaphore are bound to the parent's event
+    # loop; a forked worker must build its own instance.
+    global _intent_identifier
+    _intent_identifier = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_intent_identifier)
\ No newline at end of file
@@ -41,6 +41,10 @@ async def lifespan(app: FastAPI):
     # On startup
     _logger.info("Supervisor starting up...")
     registry.load_registry()
+    # Create the intent identifier (and pre-warm Gemini if INTENT_PREWARM=1)
+    # so the first user request doesn't pay the one-time setup cost
+    from supervisor.intent_identifier import get_intent_identifier
+    get_intent_identifier()
     # Initial health check
     await registry.health_check_agents()
     
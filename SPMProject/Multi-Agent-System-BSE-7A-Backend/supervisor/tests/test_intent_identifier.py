@@ -0,0 +1,204 @@
+import asyncio
+import json
+import re
+
+import pytest
+
+from supervisor import intent_identifier
+from supervisor.intent_identifier import IntentIdentifier
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Stands in for the Gemini model so tests run without an API key."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def _single_result(self, agent_id="adaptive_quiz_master_agent"):
+        return {
+            "agent_id": agent_id,
+            "confidence": 0.9,
+            "reasoning": "test",
+            "is_ambiguous": False,
+            "clarifying_questions": [],
+            "extracted_params": {},
+            "alternative_agents": [],
+        }
+
+    def generate_content(self, prompt, generation_config=None):
+        self.calls += 1
+        return FakeResponse(json.dumps(self._single_result()))
+
+    async def generate_content_async(self, prompt, generation_config=None):
+        self.calls += 1
+        if "### User Queries:" in prompt:
+            # Count only the numbered query lines, not the numbered task
+            # lines in the prompt tail
+            queries_section = prompt.split("### User Queries:", 1)[1]
+            n = len(re.findall(r'^\d+\. "', queries_section, flags=re.M))
+            batch = [
+                dict(self._single_result("gemini-wrapper"), query_index=i + 1)
+                for i in range(n)
+            ]
+            return FakeResponse(json.dumps(batch))
+        return FakeResponse(json.dumps(self._single_result()))
+
+
+@pytest.fixture
+def identifier():
+    intent_identifier._EXACT_CACHE.clear()
+    ident = IntentIdentifier()
+    ident.model = FakeModel()
+    return ident
+
+
+# A query with no keyword matches, so it must reach the (fake) model
+VAGUE_QUERY = "hmm not sure where to even start with this"
+
+
+def test_single_query_uses_single_prompt(identifier):
+    result = asyncio.run(identifier.identify_intent(VAGUE_QUERY))
+    assert result["agent_id"] == "adaptive_quiz_master_agent"
+    assert identifier.model.calls == 1
+
+
+def test_concurrent_queries_are_batched(identifier):
+    async def run():
+        return await asyncio.gather(
+            *(identifier.identify_intent(f"{VAGUE_QUERY} {i}") for i in range(5))
+        )
+
+    results = asyncio.run(run())
+    assert len(results) == 5
+    assert all(r["agent_id"] == "gemini-wrapper" for r in results)
+    # All five queries should have been coalesced into one Gemini call
+    assert identifier.model.calls == 1
+    # The results must come from the parsed batch response, not from the
+    # keyword fallback that resolves futures when _flush raises
+    assert all(r["reasoning"] == "test" for r in results)
+    assert all("query_index" not in r for r in results)
+
+
+def test_repeated_query_served_from_exact_cache(identifier):
+    async def run():
+        first = await identifier.identify_intent(VAGUE_QUERY)
+        second = await identifier.identify_intent(VAGUE_QUERY)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second
+    # Second call must not reach the model
+    assert identifier.model.calls == 1
+
+
+def test_dispatcher_survives_multiple_event_loops(identifier):
+    # Each asyncio.run creates a fresh loop; the dispatcher must rebuild its
+    # loop-bound queue and worker instead of hanging on the dead ones
+    async def ask(suffix):
+        return await asyncio.wait_for(
+            identifier.identify_intent(f"{VAGUE_QUERY} {suffix}"), timeout=5
+        )
+
+    first = asyncio.run(ask("a"))
+    second = asyncio.run(ask("b"))
+    assert first["agent_id"] == second["agent_id"] == "adaptive_quiz_master_agent"
+    assert identifier.model.calls == 2
+
+
+def test_unique_keyword_skips_the_model(identifier):
+    result = asyncio.run(identifier.identify_intent("check this for plagiarism"))
+    assert result["agent_id"] == "plagiarism_prevention_agent"
+    assert result["is_ambiguous"] is False
+    assert identifier.model.calls == 0
+
+
+def test_unique_keyword_ignores_generic_catchall_tokens(identifier):
+    # "why" is a gemini-wrapper keyword; it must not outrank the unique
+    # "citation" keyword regardless of token iteration order
+    result = identifier._keyword_intent("why is my citation wrong")
+    assert result["agent_id"] == "citation_manager_agent"
+
+
+def test_conflicting_unique_keywords_fall_through_to_scoring(identifier):
+    # Unique keywords of two different agents: the early exit must not fire
+    result = identifier._keyword_intent("plagiarism in my citation")
+    assert "unique to this agent" not in result["reasoning"]
+
+
+def test_fallback_matches_keywords(identifier):
+    result = identifier._fallback_intent("create a quiz with multiple choice questions")
+    assert result["agent_id"] == "adaptive_quiz_master_agent"
+    assert result["confidence"] > 0
+
+
+def test_fallback_defaults_to_gemini_wrapper(identifier):
+    result = identifier._fallback_intent("xyzzy frobnicate")
+    assert result["agent_id"] == "gemini-wrapper"
+    assert result["is_ambiguous"] is True
+
+
+def test_semantic_cache_eviction_reuses_stored_vectors():
+    faiss = pytest.importorskip("faiss")
+    np = pytest.importorskip("numpy")
+
+    class FakeEmbedder:
+        """Deterministic stand-in so the cache runs without torch installed."""
+
+        def __init__(self):
+            self.encode_calls = 0
+
+        def encode(self, texts, normalize_embeddings=True, **kwargs):
+            self.encode_calls += 1
+            vecs = np.zeros((len(texts), intent_identifier.EMBEDDING_DIM), dtype=np.float32)
+            for i, text in enumerate(texts):
+                vecs[i][hash(text) % intent_identifier.EMBEDDING_DIM] = 1.0
+            return vecs
+
+    embedder = FakeEmbedder()
+    cache = intent_identifier.SemanticIntentCache(max_entries=4, embedder=embedder)
+    result = {"agent_id": "gemini-wrapper", "confidence": 0.9}
+
+    for i in range(5):
+        query = f"query number {i}"
+        cache.put(query, result, cache.embed(query))
+
+    # Eviction rebuilt the index from stored vectors: one encode per put
+    # via cache.embed, none during the rebuild itself
+    assert embedder.encode_calls == 5
+    assert cache._index.ntotal == len(cache._entries) == 3
+
+    # Surviving entries are still retrievable through the vector tier
+    # (unseen query text, but a vector identical to a stored entry's)
+    assert cache.get("brand new phrasing", cache.embed("query number 4")) is not None
+
+
+def test_parse_batch_results_degrades_on_error_records(identifier):
+    good = json.dumps({
+        "response": {"candidates": [{"content": {"parts": [{"text": json.dumps({
+            "agent_id": "gemini-wrapper",
+            "confidence": 0.9,
+            "reasoning": "batch",
+            "is_ambiguous": False,
+        })}]}}]}
+    })
+    bad = json.dumps({"error": {"code": 500, "message": "internal"}})
+
+    results = identifier.parse_batch_results([good, bad, ""])
+    assert len(results) == 2
+    assert results[0]["reasoning"] == "batch"
+    # The failed line degrades to the keyword fallback instead of raising
+    assert results[1]["agent_id"] == "gemini-wrapper"
+    assert results[1]["is_ambiguous"] is True
+
+
+def test_unknown_agent_id_falls_back_to_gemini_wrapper(identifier):
+    result = identifier._postprocess_result(
+        {"agent_id": "nonexistent_agent", "confidence": 0.9, "reasoning": "x"}
+    )
+    assert result["agent_id"] == "gemini-wrapper"
+    assert result["confidence"] == 0.5